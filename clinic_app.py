@@ -2,70 +2,262 @@ import streamlit as st
 import sqlite3
 import pandas as pd
 from datetime import datetime, timedelta
-from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
+from io import BytesIO, TextIOWrapper
+import csv
+import queue
+import sys
+import threading
 import time
+from contextlib import contextmanager
 
 # ==========================================
 # 1. DATABASE MANAGEMENT
 # ==========================================
 
 DB_FILE = "clinic_v3.db"
+HISTORY_PAGE_SIZE = 200
+
+# sqlite3 caches prepared statements per connection, keyed by SQL text, so
+# hot statements live here as constants instead of being rebuilt inline.
+SQL_SELECT_SETTINGS = "SELECT key, value FROM settings"
+SQL_UPSERT_SETTING = (
+    "INSERT INTO settings (key, value) VALUES (?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+)
+SQL_SELECT_PATIENTS = "SELECT id, full_name, unique_id FROM patients"
+SQL_INSERT_PATIENT = "INSERT INTO patients (full_name, unique_id) VALUES (?, ?)"
+SQL_HISTORY_PAGE = (
+    "SELECT id, treatment_date, treatment_type, total, payment_amount, payment_date "
+    "FROM treatments WHERE patient_id = ? ORDER BY treatment_date DESC, id LIMIT ? OFFSET ?"
+)
+SQL_PATIENT_STANDING = (
+    "SELECT COALESCE(SUM(billed), 0), COALESCE(SUM(paid), 0), "
+    "COALESCE(SUM(billed), 0) - COALESCE(SUM(paid), 0), COUNT(*) "
+    "FROM (SELECT CAST(ROUND(total * 100) AS INTEGER) AS billed, "
+    "CAST(ROUND(payment_amount * 100) AS INTEGER) AS paid "
+    "FROM treatments WHERE patient_id = ?)"
+)
+SQL_STATEMENT_ALL = (
+    "SELECT treatment_date, treatment_type, total, payment_amount "
+    "FROM treatments WHERE patient_id = ? ORDER BY treatment_date DESC"
+)
+SQL_STATEMENT_RANGE = (
+    "SELECT treatment_date, treatment_type, total, payment_amount "
+    "FROM treatments WHERE patient_id = ? AND treatment_date BETWEEN ? AND ? ORDER BY treatment_date DESC"
+)
+SQL_INSERT_TREATMENT = (
+    "INSERT INTO treatments "
+    "(patient_id, treatment_type, treatment_date, subtotal, tax, total, payment_amount, payment_date) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_UPDATE_TREATMENT = (
+    "UPDATE treatments "
+    "SET treatment_date=?, treatment_type=?, total=?, payment_amount=?, payment_date=? "
+    "WHERE id=?"
+)
+SQL_DELETE_TREATMENT = "DELETE FROM treatments WHERE id = ?"
+
+# Amounts are stored as dollars but handled as integer cents, so balances
+# compare exactly instead of against a 0.01 epsilon. Half cents round away
+# from zero, the same way SQLite's ROUND() does in SQL_PATIENT_STANDING, so
+# statements and the Patient Records metrics always agree. Only amounts that
+# arrive as REAL dollars (DB columns, number inputs) go through to_cents.
+def to_cents(dollars):
+    cents = (dollars or 0) * 100
+    return int(cents + 0.5) if cents >= 0 else -int(0.5 - cents)
+
+def money(cents):
+    return f"${cents / 100:.2f}"
+
+class SqlitePool:
+    """Thread-safe pool of long-lived SQLite connections.
+
+    Streamlit serves each session from its own thread, so connections are
+    handed out one at a time and returned to the pool instead of being
+    opened and closed around every query. SQLite only ever has one writer,
+    so there is a single write connection behind a lock and a set of
+    read-only connections that keep serving while a write is in progress.
+    """
+
+    def __init__(self, path, min_connections=2, max_connections=10):
+        self.path = path
+        self.max_connections = max_connections
+        self._writer = self._connect()
+        self._writer_lock = threading.Lock()
+        self._idle = queue.Queue(maxsize=max_connections)
+        self._created = 0
+        self._lock = threading.Lock()
+        for _ in range(min_connections):
+            self._created += 1
+            self._idle.put(self._connect(readonly=True))
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        else:
+            # WAL keeps readers and the writer from blocking each other; it persists
+            # in the DB file and adds clinic_v3.db-wal / clinic_v3.db-shm next to it.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA wal_autocheckpoint=1000")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")  # 20 MB page cache per connection
+        conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            grow = self._created < self.max_connections
+            if grow:
+                self._created += 1
+        return self._connect(readonly=True) if grow else self._idle.get()
+
+    @contextmanager
+    def connection(self, readonly=False):
+        """Commits on success and rolls back on error, like 'with conn:'."""
+        if not readonly:
+            with self._writer_lock, self._writer:
+                yield self._writer
+            return
+        conn = self._checkout()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._idle.put(conn)
+
+@st.cache_resource
+def get_pool():
+    return SqlitePool(DB_FILE)
+
+def get_db_connection(readonly=False):
+    return get_pool().connection(readonly)
 
+@st.cache_resource
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS patients (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    full_name TEXT NOT NULL,
-                    unique_id TEXT UNIQUE
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS treatments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_id INTEGER,
-                    treatment_type TEXT,
-                    treatment_date DATE,
-                    subtotal REAL,
-                    tax REAL,
-                    total REAL,
-                    payment_amount REAL,
-                    payment_date DATE,
-                    FOREIGN KEY(patient_id) REFERENCES patients(id)
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )''')
-    defaults = {
-        "clinic_name": "My Health Clinic",
-        "clinic_address": "123 Wellness Blvd, City, ON",
-        "clinic_phone": "(555) 123-4567",
-        "hst_number": "123456789 RT0001",
-        "receipt_footer": "Thank you for your business!"
-    }
-    for key, val in defaults.items():
-        c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", (key, val))
-    conn.commit()
-    conn.close()
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def get_setting(key):
-    conn = get_db_connection()
-    val = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
-    conn.close()
-    return val['value'] if val else ""
-
-def update_setting(key, value):
-    conn = get_db_connection()
-    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
-    conn.close()
+    """Creates the schema and seeds settings once per process."""
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS patients (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        full_name TEXT NOT NULL,
+                        unique_id TEXT UNIQUE
+                    )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS treatments (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        patient_id INTEGER,
+                        treatment_type TEXT,
+                        treatment_date DATE,
+                        subtotal REAL,
+                        tax REAL,
+                        total REAL,
+                        payment_amount REAL,
+                        payment_date DATE,
+                        FOREIGN KEY(patient_id) REFERENCES patients(id)
+                    )''')
+        # Per-patient reads filter on patient_id and sort by date; the composite
+        # index serves both (and the patient delete) without a temp B-tree.
+        c.execute("CREATE INDEX IF NOT EXISTS idx_treat_patient_date ON treatments(patient_id, treatment_date DESC)")
+        # Keyed storage: lookups go straight to the row without a rowid hop
+        c.execute('''CREATE TABLE IF NOT EXISTS settings (
+                        key TEXT PRIMARY KEY,
+                        value TEXT
+                    ) WITHOUT ROWID''')
+        defaults = {
+            "clinic_name": "My Health Clinic",
+            "clinic_address": "123 Wellness Blvd, City, ON",
+            "clinic_phone": "(555) 123-4567",
+            "hst_number": "123456789 RT0001",
+            "receipt_footer": "Thank you for your business!"
+        }
+        c.executemany("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", defaults.items())
+        # Older versions bound numpy.int64 patient ids, which sqlite3 stores as
+        # raw 8-byte BLOBs; normalize them so plain int lookups match.
+        blob_ids = c.execute("SELECT id, patient_id FROM treatments WHERE typeof(patient_id) = 'blob'").fetchall()
+        c.executemany("UPDATE treatments SET patient_id = ? WHERE id = ?",
+                      [(int.from_bytes(pid, sys.byteorder), tid) for tid, pid in blob_ids])
+        # Fresh statistics so the planner picks idx_treat_patient_date
+        c.execute("ANALYZE")
+    return True
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_all_settings():
+    with get_db_connection(readonly=True) as conn:
+        rows = conn.execute(SQL_SELECT_SETTINGS).fetchall()
+    return {row['key']: row['value'] for row in rows}
+
+def update_settings(pairs):
+    """Upserts (key, value) pairs in a single transaction."""
+    with get_db_connection() as conn:
+        conn.executemany(SQL_UPSERT_SETTING, pairs)
+    get_all_settings.clear()
+
+@st.cache_data(ttl=300, show_spinner=False)
+def patient_index():
+    """Selectbox labels and the label -> (patient id, name) lookup, built once per load."""
+    with get_db_connection(readonly=True) as conn:
+        rows = conn.execute(SQL_SELECT_PATIENTS).fetchall()
+    displays = [f"{row['full_name']} (ID: {row['unique_id']})" for row in rows]
+    return displays, {display: (row['id'], row['full_name']) for display, row in zip(displays, rows)}
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_history(patient_id, page=1):
+    with get_db_connection(readonly=True) as conn:
+        return pd.read_sql(SQL_HISTORY_PAGE, conn, params=(patient_id, HISTORY_PAGE_SIZE, (page - 1) * HISTORY_PAGE_SIZE))
+
+@st.cache_data(ttl=60, show_spinner=False)
+def patient_standing(patient_id):
+    """(billed cents, paid cents, balance cents, treatment count) for one patient."""
+    with get_db_connection(readonly=True) as conn:
+        return tuple(conn.execute(SQL_PATIENT_STANDING, (patient_id,)).fetchone())
+
+@st.cache_data(ttl=60, show_spinner=False)
+def statement_rows(patient_id, start=None, end=None):
+    """Statement rows as plain tuples; start/end are ISO dates, or None for all time."""
+    if start is None:
+        query, params = SQL_STATEMENT_ALL, (patient_id,)
+    else:
+        # Plain 'YYYY-MM-DD' bounds keep the BETWEEN on the index
+        query, params = SQL_STATEMENT_RANGE, (patient_id, start, end)
+    # Plain tuples skip the DataFrame and still hash for generate_pdf's cache
+    with get_db_connection(readonly=True) as conn:
+        return tuple(tuple(row) for row in conn.execute(query, params))
+
+def bulk_insert(conn, table, df):
+    """Appends a DataFrame to `table` with one executemany on `conn`.
+
+    Unlike DataFrame.to_sql this does not commit, so several tables can be
+    restored inside a single transaction.
+    """
+    known = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+    unknown = [col for col in df.columns if col not in known]
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {', '.join(unknown)}")
+    cols = ", ".join(f'"{col}"' for col in df.columns)
+    marks = ", ".join("?" * len(df.columns))
+    # object dtype turns NaN into None and numpy scalars into Python ones
+    values = df.astype(object).where(df.notna(), None)
+    conn.executemany(f"INSERT INTO {table} ({cols}) VALUES ({marks})",
+                     values.itertuples(index=False, name=None))
+
+def dump_csv(pool, query):
+    """Writes a query's rows straight from the cursor into CSV bytes."""
+    buffer = BytesIO()
+    text = TextIOWrapper(buffer, encoding='utf-8', newline='')
+    with pool.connection(readonly=True) as conn:
+        cur = conn.execute(query)
+        writer = csv.writer(text, lineterminator='\n')
+        writer.writerow([col[0] for col in cur.description])
+        writer.writerows(cur)
+    text.flush()
+    text.detach()
+    return buffer.getvalue()
 
 # --- THE FIX: NUCLEAR DELETION CALLBACK ---
 def delete_patient_callback(patient_id):
@@ -75,12 +267,14 @@ def delete_patient_callback(patient_id):
     3. Forces an immediate app rerun.
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
         # 1. Delete Logic
-        conn.execute("DELETE FROM treatments WHERE patient_id = ?", (patient_id,))
-        conn.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            conn.execute("DELETE FROM treatments WHERE patient_id = ?", (patient_id,))
+            conn.execute("DELETE FROM patients WHERE id = ?", (patient_id,))
+        patient_index.clear()
+        load_history.clear()
+        patient_standing.clear()
+        statement_rows.clear()
         
         # 2. Clear Session State logic for dropdowns
         for key in list(st.session_state.keys()):
@@ -103,74 +297,108 @@ def delete_patient_callback(patient_id):
 # 2. PDF GENERATOR
 # ==========================================
 
-def generate_pdf(patient_name, date_range_str, records):
+@st.cache_data(max_entries=128, show_spinner=False)
+def generate_pdf(patient_name, date_range_str, records, settings):
+    """records: (treatment_date, treatment_type, total, payment_amount) tuples."""
+    # ReportLab is only needed once a statement is actually requested
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    from reportlab.lib import colors
+
     buffer = BytesIO()
     p = canvas.Canvas(buffer, pagesize=letter)
     width, height = letter
     
-    clinic_name = get_setting("clinic_name")
-    address = get_setting("clinic_address")
-    phone = get_setting("clinic_phone")
-    hst_num = get_setting("hst_number")
-    footer_text = get_setting("receipt_footer")
+    clinic_name = settings.get("clinic_name", "")
+    address = settings.get("clinic_address", "")
+    phone = settings.get("clinic_phone", "")
+    hst_num = settings.get("hst_number", "")
+    footer_text = settings.get("receipt_footer", "")
+
+    # drawString opens a new text object and re-emits the font for every
+    # call, so multi-line blocks and table cells share one text object each.
 
     # Header
     p.setFont("Helvetica-Bold", 20)
     p.drawString(50, height - 50, clinic_name)
-    p.setFont("Helvetica", 10)
-    p.drawString(50, height - 70, address)
-    p.drawString(50, height - 85, f"Phone: {phone}")
-    p.drawString(50, height - 100, f"HST #: {hst_num}")
+    header = p.beginText(50, height - 70)
+    header.setFont("Helvetica", 10, leading=15)
+    header.textLines([address, f"Phone: {phone}", f"HST #: {hst_num}"])
+    p.drawText(header)
     p.line(50, height - 110, width - 50, height - 110)
 
     # Info
     p.setFont("Helvetica-Bold", 14)
     p.drawString(50, height - 150, "STATEMENT OF ACCOUNT")
-    p.setFont("Helvetica", 12)
-    p.drawString(50, height - 175, f"Patient: {patient_name}")
-    p.drawString(50, height - 195, f"Period: {date_range_str}")
+    info = p.beginText(50, height - 175)
+    info.setFont("Helvetica", 12, leading=20)
+    info.textLines([f"Patient: {patient_name}", f"Period: {date_range_str}"])
+    p.drawText(info)
 
     # Table
-    y = height - 240
-    p.setFont("Helvetica-Bold", 10)
-    p.drawString(50, y, "Date")
-    p.drawString(130, y, "Service")
-    p.drawString(330, y, "Billed")
-    p.drawString(400, y, "Paid")
-    p.drawString(480, y, "Diff")
-    p.line(50, y - 5, width - 50, y - 5)
-    
-    y -= 25
-    p.setFont("Helvetica", 10)
-
-    total_billed = 0.0
-    total_paid = 0.0
-
-    for item in records:
-        if y < 100:
-            p.showPage()
-            y = height - 50
-        
-        billed = float(item['total'])
-        paid = float(item['payment_amount'])
-        
-        p.drawString(50, y, str(item['treatment_date']))
-        p.drawString(130, y, str(item['treatment_type']))
-        p.drawString(330, y, f"${billed:.2f}")
-        p.drawString(400, y, f"${paid:.2f}")
-        
+    def draw_table_header(y):
+        """Draws the column headings at y and returns the first row's y."""
+        columns = p.beginText()
+        columns.setFont("Helvetica-Bold", 10)
+        for x, label in ((50, "Date"), (130, "Service"), (330, "Billed"), (400, "Paid"), (480, "Diff")):
+            columns.setTextOrigin(x, y)
+            columns.textOut(label)
+        p.drawText(columns)
+        p.line(50, y - 5, width - 50, y - 5)
+        return y - 25
+
+    # Amounts, labels and diff colours are computed in one pass up front so
+    # the loop below only places precomputed strings.
+    color_by_code = (colors.black, colors.red, colors.green)
+    total_billed = total_paid = 0
+    table = []
+    for treatment_date, treatment_type, billed, paid in records:
+        billed = to_cents(billed)
+        paid = to_cents(paid)
         diff = billed - paid
-        if diff > 0.01: 
-            p.setFillColor(colors.red)
-        elif diff < -0.01:
-            p.setFillColor(colors.green)
-        
-        p.drawString(480, y, f"${diff:.2f}")
-        p.setFillColor(colors.black)
-        
         total_billed += billed
         total_paid += paid
-        y -= 20
+        table.append((str(treatment_date), str(treatment_type), money(billed), money(paid), money(diff),
+                      1 if diff > 0 else 2 if diff < 0 else 0))
+
+    # Page breaks are worked out once per page rather than tested per row;
+    # continuation pages repeat the column headings.
+    y = draw_table_header(height - 240)
+    start = 0
+    while True:
+        per_page = int((y - 100) // 20) + 1
+        rows = p.beginText()
+        rows.setFont("Helvetica", 10)
+        diff_cells = ([], [], [])  # (y, text) per colour code
+        for date_s, service_s, billed_s, paid_s, diff_s, color in table[start:start + per_page]:
+            for x, text in ((50, date_s), (130, service_s), (330, billed_s), (400, paid_s)):
+                rows.setTextOrigin(x, y)
+                rows.textOut(text)
+            diff_cells[color].append((y, diff_s))
+            y -= 20
+
+        # Diff cells are drawn grouped by colour: one fill change per colour
+        # per page instead of a set/reset pair on every coloured row.
+        for code, cells in enumerate(diff_cells):
+            if code and cells:
+                rows.setFillColor(color_by_code[code])
+            for cell_y, text in cells:
+                rows.setTextOrigin(480, cell_y)
+                rows.textOut(text)
+        if diff_cells[1] or diff_cells[2]:
+            rows.setFillColor(colors.black)
+        p.drawText(rows)
+
+        start += per_page
+        if start >= len(table):
+            break
+        p.showPage()
+        y = draw_table_header(height - 50)
+
+    # Keep the summary block on one page and clear of the footer
+    if y - 95 < 70:
+        p.showPage()
+        y = height - 50
 
     # Summary
     y -= 20
@@ -181,23 +409,23 @@ def generate_pdf(patient_name, date_range_str, records):
     
     p.setFont("Helvetica-Bold", 12)
     p.drawString(250, y, "Total Billed:")
-    p.drawString(400, y, f"${total_billed:.2f}")
+    p.drawString(400, y, money(total_billed))
     
     y -= 20
     p.drawString(250, y, "Total Paid:")
-    p.drawString(400, y, f"${total_paid:.2f}")
+    p.drawString(400, y, money(total_paid))
     
     y -= 25
     p.setFont("Helvetica-Bold", 14)
     
-    if net_position > 0.01:
+    if net_position > 0:
         p.drawString(250, y, "BALANCE DUE:")
         p.setFillColor(colors.red)
-        p.drawString(400, y, f"${net_position:.2f}")
-    elif net_position < -0.01:
+        p.drawString(400, y, money(net_position))
+    elif net_position < 0:
         p.drawString(250, y, "CREDIT REMAINING:")
         p.setFillColor(colors.orange)
-        p.drawString(400, y, f"${abs(net_position):.2f}")
+        p.drawString(400, y, money(-net_position))
     else:
         p.drawString(250, y, "BALANCE:")
         p.setFillColor(colors.green)
@@ -209,19 +437,54 @@ def generate_pdf(patient_name, date_range_str, records):
 
     p.showPage()
     p.save()
-    buffer.seek(0)
-    return buffer
+    return buffer.getvalue()
 
 # ==========================================
 # 3. UI MAIN
 # ==========================================
 
+@st.fragment
+def statement_section(pat_id, pat_name):
+    """Statement date range and PDF download; reruns on its own when its widgets change."""
+    st.divider()
+    st.subheader("🖨️ Generate Receipt / Statement")
+    
+    col_check, col_d1, col_d2 = st.columns([1, 2, 2])
+    with col_check:
+        st.write("") 
+        use_all_time = st.checkbox("Select All Time?", value=False)
+    with col_d1:
+        today = datetime.now().date()
+        start_date = st.date_input("Start Date", today - timedelta(days=365), disabled=use_all_time)
+    with col_d2:
+        end_date = st.date_input("End Date", today, disabled=use_all_time)
+
+    statement_key = (pat_id, use_all_time, start_date, end_date)
+    if st.button("Generate Statement PDF"):
+        st.session_state['statement_key'] = statement_key
+
+    # Rendered outside the button so the download's own rerun keeps it;
+    # unchanged records come straight back from generate_pdf's cache.
+    if st.session_state.get('statement_key') == statement_key:
+        if use_all_time:
+            records = statement_rows(pat_id)
+        else:
+            records = statement_rows(pat_id, start_date.isoformat(), end_date.isoformat())
+
+        if records:
+            date_str = "ALL TIME" if use_all_time else f"{start_date} to {end_date}"
+            pdf_data = generate_pdf(pat_name, date_str, records, get_all_settings())
+            st.download_button(label="⬇️ Download PDF", data=pdf_data, file_name=f"Statement_{pat_name}.pdf", mime="application/pdf")
+        else:
+            st.error("No records found in that date range.")
+
 def main():
     st.set_page_config(page_title="Clinic Manager", page_icon="🏥", layout="wide")
     init_db()
 
     # --- REFRESH BUTTON (Manual) ---
     if st.sidebar.button("🔄 Force Refresh App"):
+        st.cache_data.clear()
         st.session_state['data_version'] += 1
         st.rerun()
 
@@ -241,21 +504,18 @@ def main():
 
         with col1:
             st.subheader("1. Patient")
-            conn = get_db_connection()
-            patients_df = pd.read_sql("SELECT * FROM patients", conn)
-            conn.close()
+            displays, patient_by_display = patient_index()
 
             tab_exist, tab_new = st.tabs(["Existing Patient", "Register New"])
             selected_patient_id = None
             
             with tab_exist:
-                if not patients_df.empty:
-                    patients_df['display'] = patients_df['full_name'] + " (ID: " + patients_df['unique_id'] + ")"
+                if displays:
                     # Key ensures refresh on version change
                     key_dynamic = f"new_treat_patient_{st.session_state['data_version']}"
                     
-                    selected_patient_str = st.selectbox("Search Patient", patients_df['display'], key=key_dynamic)
-                    selected_patient_id = patients_df.loc[patients_df['display'] == selected_patient_str, 'id'].values[0]
+                    selected_patient_str = st.selectbox("Search Patient", displays, key=key_dynamic)
+                    selected_patient_id, _ = patient_by_display[selected_patient_str]
                 else:
                     st.info("No patients found.")
 
@@ -264,10 +524,9 @@ def main():
                 new_id = st.text_input("Patient ID (Unique)")
                 if st.button("Register Patient"):
                     try:
-                        conn = get_db_connection()
-                        conn.execute("INSERT INTO patients (full_name, unique_id) VALUES (?, ?)", (new_name, new_id))
-                        conn.commit()
-                        conn.close()
+                        with get_db_connection() as conn:
+                            conn.execute(SQL_INSERT_PATIENT, (new_name, new_id))
+                        patient_index.clear()
                         st.success(f"Registered {new_name}!")
                         st.session_state['data_version'] += 1
                         st.rerun()
@@ -279,43 +538,44 @@ def main():
             treatment_type = st.selectbox("Service Type", ["Magnetic Field Therapy", "Helium Neon Laser"])
             treatment_date = st.date_input("Date of Service", datetime.now())
 
-            cost = 25.00
-            hst = cost * 0.13
-            total = cost + hst
+            cost_cents = 2500
+            hst_cents = (cost_cents * 13 + 50) // 100  # 13% HST, half up in exact integer cents
+            total_cents = cost_cents + hst_cents
 
-            st.markdown(f"**Total Cost:** :green[**${total:.2f}**]")
+            st.markdown(f"**Total Cost:** :green[**{money(total_cents)}**]")
             st.divider()
             
             st.write(" **Payment Status**")
             is_paid = st.checkbox("Payment Received?", value=True)
             
-            payment_amount = 0.0
+            paid_cents = 0
             payment_date = None
 
             if is_paid:
                 payment_date = st.date_input("Payment Date", datetime.now())
-                payment_amount = st.number_input("Amount Paid ($)", min_value=0.0, value=total, step=0.01)
+                paid_cents = to_cents(st.number_input("Amount Paid ($)", min_value=0.0, value=total_cents / 100, step=0.01))
                 
-                bal = total - payment_amount
-                if bal > 0.01:
-                    st.markdown(f"#### :red[Balance Remaining: ${bal:.2f}]")
-                elif bal < -0.01:
-                    st.markdown(f"#### :orange[Overpayment (Credit): ${abs(bal):.2f}]")
+                bal_cents = total_cents - paid_cents
+                if bal_cents > 0:
+                    st.markdown(f"#### :red[Balance Remaining: {money(bal_cents)}]")
+                elif bal_cents < 0:
+                    st.markdown(f"#### :orange[Overpayment (Credit): {money(-bal_cents)}]")
                 else:
                     st.markdown(f"#### :green[Paid in Full]")
             else:
-                st.markdown(f"#### :red[Balance Due: ${total:.2f}]")
+                st.markdown(f"#### :red[Balance Due: {money(total_cents)}]")
 
             if st.button("💾 Save Record", type="primary"):
                 if selected_patient_id:
-                    conn = get_db_connection()
-                    conn.execute('''INSERT INTO treatments 
-                                    (patient_id, treatment_type, treatment_date, subtotal, tax, total, payment_amount, payment_date) 
-                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', 
-                                    (selected_patient_id, treatment_type, treatment_date, cost, hst, total, payment_amount, payment_date))
-                    conn.commit()
-                    conn.close()
-                    st.success(f"Saved! Payment recorded: ${payment_amount:.2f}")
+                    with get_db_connection() as conn:
+                        conn.execute(SQL_INSERT_TREATMENT,
+                                     (selected_patient_id, treatment_type, treatment_date.isoformat(),
+                                      cost_cents / 100, hst_cents / 100, total_cents / 100, paid_cents / 100,
+                                      payment_date.isoformat() if payment_date else None))
+                    load_history.clear()
+                    patient_standing.clear()
+                    statement_rows.clear()
+                    st.success(f"Saved! Payment recorded: {money(paid_cents)}")
                 else:
                     st.error("Select a patient first.")
 
@@ -325,45 +585,35 @@ def main():
     elif page == "Patient Records":
         st.header("📂 Patient Financials")
 
-        conn = get_db_connection()
-        patients_df = pd.read_sql("SELECT * FROM patients", conn)
+        displays, patient_by_display = patient_index()
         
-        if patients_df.empty:
+        if not displays:
             st.warning("No patients found.")
-            conn.close()
             return
 
         # 1. SELECT PATIENT
-        patients_df['display'] = patients_df['full_name'] + " (ID: " + patients_df['unique_id'] + ")"
-        
         # Key ensures refresh on version change
         key_dynamic_hist = f"history_patient_{st.session_state['data_version']}"
-        selected_patient_str = st.selectbox("Select Patient:", patients_df['display'], key=key_dynamic_hist)
+        selected_patient_str = st.selectbox("Select Patient:", displays, key=key_dynamic_hist)
         
-        pat_id = patients_df.loc[patients_df['display'] == selected_patient_str, 'id'].values[0]
-        pat_name = patients_df.loc[patients_df['display'] == selected_patient_str, 'full_name'].values[0]
+        pat_id, pat_name = patient_by_display[selected_patient_str]
 
         # 2. CALCULATE STANDING
-        all_time_df = pd.read_sql("SELECT * FROM treatments WHERE patient_id = ?", conn, params=(pat_id,))
-        all_time_df['total'] = all_time_df['total'].fillna(0.0)
-        all_time_df['payment_amount'] = all_time_df['payment_amount'].fillna(0.0)
+        billed_cents, paid_cents, balance_cents, n_treatments = patient_standing(pat_id)
         
-        if not all_time_df.empty:
-            total_billed = all_time_df['total'].sum()
-            total_paid = all_time_df['payment_amount'].sum()
-            net_position = total_billed - total_paid
+        if n_treatments:
 
             st.divider()
             st.subheader(f"Financial Status: {pat_name}")
             
             c1, c2, c3 = st.columns(3)
-            c1.metric("Total Billed", f"${total_billed:.2f}")
-            c2.metric("Total Paid", f"${total_paid:.2f}")
+            c1.metric("Total Billed", money(billed_cents))
+            c2.metric("Total Paid", money(paid_cents))
             
-            if net_position > 0.01:
-                c3.metric("Current Balance", f"${net_position:.2f}", delta="-OWING", delta_color="inverse")
-            elif net_position < -0.01:
-                c3.metric("Current Credit", f"${abs(net_position):.2f}", delta="CREDIT", delta_color="normal")
+            if balance_cents > 0:
+                c3.metric("Current Balance", money(balance_cents), delta="-OWING", delta_color="inverse")
+            elif balance_cents < 0:
+                c3.metric("Current Credit", money(-balance_cents), delta="CREDIT", delta_color="normal")
             else:
                 c3.metric("Status", "Paid in Full", delta="OK")
 
@@ -372,13 +622,14 @@ def main():
         st.subheader("📋 Edit / Delete Records")
         st.info("💡 Edit cells below. To delete a row: Select it and press 'Delete'. Click 'Save Changes' to commit.")
 
-        query_all = "SELECT id, treatment_date, treatment_type, total, payment_amount, payment_date FROM treatments WHERE patient_id = ? ORDER BY treatment_date DESC"
-        editor_df = pd.read_sql(query_all, conn, params=(pat_id,))
+        n_pages = max(1, -(-n_treatments // HISTORY_PAGE_SIZE))
+        history_page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1, step=1) if n_pages > 1 else 1
+        editor_df = load_history(pat_id, history_page)
         
         edited_df = st.data_editor(
             editor_df, 
             num_rows="dynamic", 
-            key="data_editor",
+            key=f"data_editor_{history_page}",
             disabled=["id"],
             hide_index=True
         )
@@ -388,65 +639,25 @@ def main():
                 original_ids = set(editor_df['id'].tolist())
                 new_ids = set(edited_df['id'].tolist())
                 deleted_ids = original_ids - new_ids
+
+                # Rows added in the editor have no id yet and are skipped
+                kept_df = edited_df.loc[edited_df['id'].notna(),
+                                        ['treatment_date', 'treatment_type', 'total', 'payment_amount', 'payment_date', 'id']]
                 
-                for del_id in deleted_ids:
-                    conn.execute("DELETE FROM treatments WHERE id = ?", (del_id,))
-                
-                for index, row in edited_df.iterrows():
-                    if pd.notna(row['id']):
-                        conn.execute('''
-                            UPDATE treatments 
-                            SET treatment_date=?, treatment_type=?, total=?, payment_amount=?, payment_date=?
-                            WHERE id=?
-                        ''', (
-                            row['treatment_date'], 
-                            row['treatment_type'], 
-                            row['total'], 
-                            row['payment_amount'], 
-                            row['payment_date'],
-                            row['id']
-                        ))
-                conn.commit()
+                with get_db_connection() as conn:
+                    conn.executemany(SQL_DELETE_TREATMENT, [(del_id,) for del_id in deleted_ids])
+                    conn.executemany(SQL_UPDATE_TREATMENT, kept_df.itertuples(index=False, name=None))
+                load_history.clear()
+                patient_standing.clear()
+                statement_rows.clear()
                 st.success("Changes saved successfully!")
                 st.rerun()
             except Exception as e:
                 st.error(f"Error saving changes: {e}")
-        
-        conn.close()
 
         # 4. GENERATE STATEMENT
-        st.divider()
-        st.subheader("🖨️ Generate Receipt / Statement")
-        
-        col_check, col_d1, col_d2 = st.columns([1, 2, 2])
-        with col_check:
-            st.write("") 
-            use_all_time = st.checkbox("Select All Time?", value=False)
-        with col_d1:
-            today = datetime.now().date()
-            start_date = st.date_input("Start Date", today - timedelta(days=365), disabled=use_all_time)
-        with col_d2:
-            end_date = st.date_input("End Date", today, disabled=use_all_time)
-
-        if st.button("Generate Statement PDF"):
-            conn = get_db_connection()
-            if use_all_time:
-                 query = 'SELECT * FROM treatments WHERE patient_id = ? ORDER BY treatment_date DESC'
-                 params = (pat_id,)
-            else:
-                 query = 'SELECT * FROM treatments WHERE patient_id = ? AND treatment_date BETWEEN ? AND ? ORDER BY treatment_date DESC'
-                 params = (pat_id, start_date, end_date)
-            range_df = pd.read_sql(query, conn, params=params)
-            conn.close()
-
-            if not range_df.empty:
-                records = range_df.to_dict('records')
-                date_str = "ALL TIME" if use_all_time else f"{start_date} to {end_date}"
-                pdf_data = generate_pdf(pat_name, date_str, records)
-                st.download_button(label="⬇️ Download PDF", data=pdf_data, file_name=f"Statement_{pat_name}.pdf", mime="application/pdf")
-            else:
-                st.error("No records found in that date range.")
-                
+        statement_section(pat_id, pat_name)
+
         # 5. DANGER ZONE - DELETE PATIENT
         st.divider()
         with st.expander("🚨 Danger Zone: Delete Patient Profile"):
@@ -467,18 +678,21 @@ def main():
         st.header("⚙️ Settings")
         
         with st.expander("🧾 Receipt Customization", expanded=True):
+            settings = get_all_settings()
             with st.form("settings"):
-                c_name = st.text_input("Clinic Name", value=get_setting("clinic_name"))
-                c_addr = st.text_input("Clinic Address", value=get_setting("clinic_address"))
-                c_phone = st.text_input("Phone", value=get_setting("clinic_phone"))
-                c_hst = st.text_input("HST #", value=get_setting("hst_number"))
-                c_foot = st.text_input("Footer", value=get_setting("receipt_footer"))
+                c_name = st.text_input("Clinic Name", value=settings.get("clinic_name", ""))
+                c_addr = st.text_input("Clinic Address", value=settings.get("clinic_address", ""))
+                c_phone = st.text_input("Phone", value=settings.get("clinic_phone", ""))
+                c_hst = st.text_input("HST #", value=settings.get("hst_number", ""))
+                c_foot = st.text_input("Footer", value=settings.get("receipt_footer", ""))
                 if st.form_submit_button("Save Details"):
-                    update_setting("clinic_name", c_name)
-                    update_setting("clinic_address", c_addr)
-                    update_setting("clinic_phone", c_phone)
-                    update_setting("hst_number", c_hst)
-                    update_setting("receipt_footer", c_foot)
+                    update_settings([
+                        ("clinic_name", c_name),
+                        ("clinic_address", c_addr),
+                        ("clinic_phone", c_phone),
+                        ("hst_number", c_hst),
+                        ("receipt_footer", c_foot),
+                    ])
                     st.success("Updated!")
 
         st.divider()
@@ -488,15 +702,16 @@ def main():
         
         with tab_backup:
             st.write("Download your data periodically to keep it safe.")
-            conn = get_db_connection()
-            df_pat_bk = pd.read_sql("SELECT * FROM patients", conn)
-            df_treat_bk = pd.read_sql("SELECT * FROM treatments", conn)
-            conn.close()
+            # CSV encoding holds the GIL, so exporting on two threads gained
+            # nothing measurable; both run here on one pooled read connection.
+            pool = get_pool()
+            pat_bytes = dump_csv(pool, "SELECT * FROM patients")
+            treat_bytes = dump_csv(pool, "SELECT * FROM treatments")
             b1, b2 = st.columns(2)
             with b1:
-                st.download_button("Download Patients (CSV)", data=df_pat_bk.to_csv(index=False).encode('utf-8'), file_name="backup_patients.csv", mime="text/csv")
+                st.download_button("Download Patients (CSV)", data=pat_bytes, file_name="backup_patients.csv", mime="text/csv")
             with b2:
-                st.download_button("Download Treatments (CSV)", data=df_treat_bk.to_csv(index=False).encode('utf-8'), file_name="backup_treatments.csv", mime="text/csv")
+                st.download_button("Download Treatments (CSV)", data=treat_bytes, file_name="backup_treatments.csv", mime="text/csv")
         
         with tab_restore:
             st.warning("⚠️ Uploading files will MERGE data into the database. Use this if your data was wiped.")
@@ -506,14 +721,19 @@ def main():
             if st.button("Start Restore Process"):
                 if up_pat and up_treat:
                     try:
-                        conn = get_db_connection()
                         new_pats = pd.read_csv(up_pat)
                         new_treats = pd.read_csv(up_treat)
-                        new_pats.to_sql('patients', conn, if_exists='append', index=False)
+                        # One transaction: a failed restore leaves nothing half-merged
+                        with get_db_connection() as conn:
+                            bulk_insert(conn, 'patients', new_pats)
+                            bulk_insert(conn, 'treatments', new_treats)
+                            conn.execute("ANALYZE")
                         st.success(f"✅ Restored {len(new_pats)} patients.")
-                        new_treats.to_sql('treatments', conn, if_exists='append', index=False)
                         st.success(f"✅ Restored {len(new_treats)} treatment records.")
-                        conn.close()
+                        patient_index.clear()
+                        load_history.clear()
+                        patient_standing.clear()
+                        statement_rows.clear()
                         st.balloons()
                     except sqlite3.IntegrityError:
                         st.error("Error: Some of this data already exists in the system.")